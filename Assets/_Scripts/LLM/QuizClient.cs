@@ -299,6 +299,7 @@ public class QuizClient : MonoBehaviour
         string msg;
         if (submissionResult.Success)
         {
+            if (_hasSelected) StartCoroutine(SendAttemptToQuizServer());
             msg = $"Thank you! Your final grade is {correctCount}/{total} and has been submitted to your teacher.";
             piperDriver?.Speak("Thank you! Your final grade has been submitted to your teacher.");
         }
@@ -374,6 +375,50 @@ public class QuizClient : MonoBehaviour
         return result;
     }
 
+    // Lets the quiz server update its per-quiz difficulty stats without re-reading the database
+    private IEnumerator SendAttemptToQuizServer()
+    {
+        var grades = new List<string>();
+        for (int i = 0; i < 10; i++)
+        {
+            grades.Add(i < questions.Count && questionGrades.TryGetValue(questions[i].id, out int grade)
+                ? grade.ToString(CultureInfo.InvariantCulture)
+                : "null");
+        }
+        string jsonData = "{\"attempt\":{\"quiz_id\":" + _selected.quizId +
+                          ",\"student_id\":\"" + EscapeJson(PlayerPrefs.GetString("UserID", "")) +
+                          "\",\"total_score\":" + correctCount +
+                          ",\"grades\":[" + string.Join(",", grades) + "]}}";
+
+        TcpClient attemptClient = new TcpClient();
+        yield return StartCoroutine(ConnectToServer(attemptClient, serverAddress, serverPort));
+        if (!attemptClient.Connected)
+        {
+            attemptClient.Close();
+            yield break;
+        }
+
+        try
+        {
+            byte[] data = Encoding.UTF8.GetBytes(jsonData);
+            byte[] lengthBytes = BitConverter.GetBytes((uint)data.Length);
+            if (BitConverter.IsLittleEndian) Array.Reverse(lengthBytes);
+            NetworkStream stream = attemptClient.GetStream();
+            stream.Write(lengthBytes, 0, lengthBytes.Length);
+            stream.Write(data, 0, data.Length);
+            // Wait for the reply header so the server is not cut off mid-send
+            stream.Read(new byte[4], 0, 4);
+        }
+        catch (Exception e)
+        {
+            Debug.LogWarning("Could not send attempt to quiz server: " + e.Message);
+        }
+        finally
+        {
+            attemptClient.Close();
+        }
+    }
+
     private IEnumerator SubmitQuizResultsCoroutine(SubmissionResult submissionResult)
     {
         Task<SubmissionResult> submitTask = SubmitQuizResultsAsync();
@@ -437,7 +482,8 @@ public class QuizClient : MonoBehaviour
         {
             string title = _hasSelected && !string.IsNullOrWhiteSpace(_selected.title) ? _selected.title : topicToUse;
             string notes = _hasSelected ? (_selected.notes ?? "") : "";
-            string jsonData = "{\"title\":\"" + EscapeJson(title) + "\",\"notes\":\"" + EscapeJson(notes) + "\"}";
+            string quizIdField = _hasSelected ? ",\"quiz_id\":" + _selected.quizId : "";
+            string jsonData = "{\"title\":\"" + EscapeJson(title) + "\",\"notes\":\"" + EscapeJson(notes) + "\"" + quizIdField + "}";
             byte[] data = Encoding.UTF8.GetBytes(jsonData);
 
             stream = client.GetStream();
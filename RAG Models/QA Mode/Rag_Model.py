@@ -1,8 +1,9 @@
 import os
+import sys
 import json
+import hashlib
 import socket
 import threading
-from groq import Groq
 from datetime import datetime
 import time
 import struct
@@ -15,10 +16,32 @@ import numpy as np
 import faiss
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from llm_gateway import LLMGateway
+from llm_scheduler import (RemoteLLMScheduler, RequestShedError, estimate_tokens, admission_hooks,
+                           PRIORITY_LIVE_QA, PRIORITY_BACKGROUND, SCHEDULER_HOST, SCHEDULER_PORT)
+
 class MrRashidRAGBiologyBot:
-    def __init__(self, api_key, curriculum_chunks_path, faiss_index_path, host="26.68.227.247", port=8000):
-        self.client = Groq(api_key=api_key)
+    # Intents whose answers depend on the lesson rather than the student's wording
+    CACHED_INTENTS = {
+        "summary": "Give me a summary of the lesson {lesson}.",
+        "concept_map": "Create a concept map for the lesson {lesson}.",
+        "exam_prep": "How should I prepare for the exam on the lesson {lesson}?"
+    }
+
+    def __init__(self, api_key, curriculum_chunks_path, faiss_index_path, host="26.68.227.247", port=8000,
+                 lesson_cache_path="lesson_cache.json", scheduler_address=(SCHEDULER_HOST, SCHEDULER_PORT)):
         self.model = "moonshotai/kimi-k2-instruct"
+        self.fallback_model = "llama-3.1-8b-instant"
+        self.llm_timeout = 20.0
+        self.llm_stats_path = "llm_latency_stats.json"
+        # Shared with the quiz server so per-model provider limits and quiz priority hold across both
+        self.scheduler_address = scheduler_address
+        self.scheduler = RemoteLLMScheduler(*scheduler_address)
+        # Pooled client: hedges after the model's p95, falls back to the faster model when kimi is slow;
+        # hedges and fail-overs only go out when the scheduler has spare capacity for them
+        self.gateway = LLMGateway(api_key, [self.model, self.fallback_model], slow_threshold=8.0,
+                                  **admission_hooks(self.scheduler))
         self.conversation_history = []
         self.max_history = 5  
         self.turn_counter = 0
@@ -36,6 +59,11 @@ class MrRashidRAGBiologyBot:
         self.emb_model = SentenceTransformer("intfloat/multilingual-e5-base")
         print(f"Loaded {len(self.df_chunks)} curriculum chunks")
         
+        # Load precomputed per-lesson responses
+        self.lesson_cache_path = lesson_cache_path
+        self.lesson_cache = {}
+        self.load_lesson_cache()
+        
         # Load conversation history
         self.load_conversation_history()
         
@@ -67,6 +95,73 @@ class MrRashidRAGBiologyBot:
             print(f"Error saving history: {str(e)}")
             return False
     
+    def save_llm_stats(self):
+        """Export per-model LLM latency stats; serialized like the history file"""
+        with self.lock:
+            return self.gateway.save_stats(self.llm_stats_path)
+    
+    def load_lesson_cache(self):
+        """Load precomputed lesson responses from JSON file, skipping lessons whose fingerprint changed"""
+        try:
+            if self.lesson_cache_path and os.path.exists(self.lesson_cache_path):
+                with open(self.lesson_cache_path, 'r', encoding='utf-8') as file:
+                    data = json.load(file)
+                lessons = data.get("lessons", {})
+                fingerprints = {
+                    lesson_key: self.lesson_fingerprint(lesson, context_text)
+                    for lesson_key, lesson, context_text in self.lesson_contexts()
+                }
+                self.lesson_cache = {
+                    lesson_key: entry for lesson_key, entry in lessons.items()
+                    if isinstance(entry, dict) and entry.get("fingerprint") == fingerprints.get(lesson_key)
+                }
+                print(f"Loaded cached responses for {len(self.lesson_cache)} lessons")
+                stale = len(lessons) - len(self.lesson_cache)
+                if stale:
+                    print(f"Ignoring {stale} stale cached lessons (model, prompts or chunks changed), "
+                          f"rerun build_lesson_cache.py to regenerate them")
+            return True
+        except Exception as e:
+            print(f"Error loading lesson cache: {str(e)}")
+            return False
+    
+    def save_lesson_cache(self):
+        """Save precomputed lesson responses to JSON file"""
+        try:
+            data = {
+                "model": self.model,
+                "generated_at": datetime.now().isoformat(),
+                "lessons": self.lesson_cache
+            }
+            with open(self.lesson_cache_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file, indent=2, ensure_ascii=False)
+            return True
+        except Exception as e:
+            print(f"Error saving lesson cache: {str(e)}")
+            return False
+    
+    @staticmethod
+    def lesson_cache_key(chapter, lesson):
+        """Index key of a lesson in the cache file"""
+        return f"{chapter} | {lesson}"
+    
+    def lesson_contexts(self):
+        """Yield (cache key, lesson, context text) for every lesson in the curriculum chunks"""
+        for (chapter, lesson), lesson_chunks in self.df_chunks.groupby(['chapter', 'lesson'], sort=False):
+            context_chunks = [
+                f"Chapter: {chapter} | Lesson: {lesson}\n{str(text).strip()}"
+                for text in lesson_chunks['text']
+            ]
+            yield self.lesson_cache_key(chapter, lesson), lesson, "\n\n".join(context_chunks)
+    
+    def lesson_fingerprint(self, lesson, context_text):
+        """Hash of everything a cached lesson answer depends on: model, prompts and the lesson's chunks"""
+        digest = hashlib.sha256(self.model.encode('utf-8'))
+        for intent, request_template in sorted(self.CACHED_INTENTS.items()):
+            for part in (intent, self.get_intent_prompt(intent, context_text), request_template.format(lesson=lesson)):
+                digest.update(b"\0" + part.encode('utf-8'))
+        return digest.hexdigest()
+    
     def manage_conversation_history(self, user_input, bot_response, request_timestamp, response_timestamp):
         """Add current turn to conversation history with accurate timestamps"""
         with self.lock:
@@ -116,19 +211,43 @@ class MrRashidRAGBiologyBot:
             'top_chunks': top_chunks
         }
     
-    def retrieve_context(self, query, k=3):
-        """Retrieve relevant context chunks for a given query"""
-        query_result = self.score_query(query, threshold=0.815, k=k)
-        
+    def format_context_chunks(self, top_chunks):
+        """Format retrieved chunks with their chapter and lesson"""
         formatted_chunks = []
-        for chunk in query_result['top_chunks']:
+        for chunk in top_chunks:
             lesson = chunk['metadata']['lesson']
             chapter = chunk['metadata']['chapter']
             text = chunk['text'].strip()
             formatted = f"Chapter: {chapter} | Lesson: {lesson}\n{text}"
             formatted_chunks.append(formatted)
-        
-        return formatted_chunks, query_result['score'], query_result['in_curriculum']
+        return formatted_chunks
+    
+    def retrieve_context(self, query, k=3):
+        """Retrieve relevant context chunks for a given query"""
+        query_result = self.score_query(query, threshold=0.815, k=k)
+        formatted_chunks = self.format_context_chunks(query_result['top_chunks'])
+        return formatted_chunks, query_result['score'], query_result['in_curriculum'], query_result['top_chunks']
+    
+    def resolve_lesson(self, top_chunks):
+        """Return the cache key of the lesson all top chunks belong to, or None if they disagree"""
+        if not top_chunks:
+            return None
+        lessons = {
+            self.lesson_cache_key(chunk['metadata']['chapter'], chunk['metadata']['lesson'])
+            for chunk in top_chunks
+        }
+        if len(lessons) != 1:
+            return None
+        return lessons.pop()
+    
+    def get_cached_response(self, intent, top_chunks):
+        """Serve a precomputed answer when the intent is static and the query maps to one lesson"""
+        if intent not in self.CACHED_INTENTS or not self.lesson_cache:
+            return None
+        lesson_key = self.resolve_lesson(top_chunks)
+        if lesson_key is None:
+            return None
+        return self.lesson_cache.get(lesson_key, {}).get("responses", {}).get(intent)
     
     def detect_intent(self, query):
         """Detect intent from English queries"""
@@ -251,10 +370,10 @@ class MrRashidRAGBiologyBot:
         
         return prompts.get(intent, prompts["qa"])
 
-    def generate_response(self, user_input):
+    def generate_response(self, user_input, client_id="default"):
         try:
             # Retrieve context from RAG system
-            context_chunks, similarity_score, in_curriculum = self.retrieve_context(user_input)
+            context_chunks, similarity_score, in_curriculum, top_chunks = self.retrieve_context(user_input)
             
             # Handle out-of-curriculum queries
             if not in_curriculum:
@@ -262,6 +381,11 @@ class MrRashidRAGBiologyBot:
             
             # Detect intent and get appropriate prompt
             intent = self.detect_intent(user_input)
+            
+            cached_response = self.get_cached_response(intent, top_chunks)
+            if cached_response:
+                return cached_response
+            
             context_text = "\n\n".join(context_chunks) if context_chunks else "No specific context available."
             system_prompt = self.get_intent_prompt(intent, context_text)
 
@@ -278,21 +402,68 @@ class MrRashidRAGBiologyBot:
                 "content": user_input
             })
             
-            chat_completion = self.client.chat.completions.create(
-                messages=messages,
+            return self.chat_completion(messages, client_id=client_id)
+            
+        except RequestShedError:
+            return "Many students are asking me questions right now. Please ask your biology question again in a moment."
+        except Exception as e:
+            return f"I encountered a technical issue. Please try asking your biology question again."
+    
+    def chat_completion(self, messages, timeout=None, hedge=True, priority=PRIORITY_LIVE_QA, client_id="default"):
+        """Send messages to the LLM through the rate-limit scheduler and return the stripped reply"""
+        max_tokens = 150
+        return self.scheduler.run(
+            lambda remaining: self.gateway.chat(
+                messages,
                 model=self.model,
-                max_tokens=150,
+                timeout=remaining,
+                hedge=hedge,
+                max_tokens=max_tokens,
                 temperature=0.3,
                 top_p=0.9,
                 presence_penalty=0.1,
                 frequency_penalty=0.1
-            )
+            ),
+            model=self.model,
+            client_id=client_id,
+            priority=priority,
+            estimated_tokens=estimate_tokens(messages, max_tokens),
+            timeout=timeout or self.llm_timeout
+        )
+    
+    def build_lesson_cache(self, overwrite=False):
+        """Offline job: pre-generate the static intent responses for every lesson in the curriculum"""
+        generated = 0
+        for lesson_key, lesson, context_text in self.lesson_contexts():
+            # Answers made for another model, prompt or chunk text are regenerated
+            fingerprint = self.lesson_fingerprint(lesson, context_text)
+            entry = self.lesson_cache.get(lesson_key)
+            if entry is None or entry.get("fingerprint") != fingerprint:
+                entry = {"fingerprint": fingerprint, "responses": {}}
+                self.lesson_cache[lesson_key] = entry
+            responses = entry["responses"]
             
-            response = chat_completion.choices[0].message.content.strip()
-            return response
+            for intent, request_template in self.CACHED_INTENTS.items():
+                if responses.get(intent) and not overwrite:
+                    continue
+                messages = [
+                    {"role": "system", "content": self.get_intent_prompt(intent, context_text)},
+                    {"role": "user", "content": request_template.format(lesson=lesson)}
+                ]
+                try:
+                    # Offline: no hedging and a generous deadline, latency does not matter here
+                    responses[intent] = self.chat_completion(messages, timeout=120.0, hedge=False,
+                                                         priority=PRIORITY_BACKGROUND, client_id="pregeneration")
+                    generated += 1
+                    print(f"Cached {intent} for {lesson_key}")
+                except Exception as e:
+                    print(f"Error generating {intent} for {lesson_key}: {e}")
             
-        except Exception as e:
-            return f"I encountered a technical issue. Please try asking your biology question again."
+            # Save after every lesson so an interrupted run can resume
+            self.save_lesson_cache()
+        
+        print(f"Generated {generated} responses for {len(self.lesson_cache)} lessons")
+        return generated
     
     def create_output_json(self, user_input, bot_response, request_timestamp, response_timestamp):
         """Create output JSON with current turn only and accurate timestamps"""
@@ -372,6 +543,8 @@ class MrRashidRAGBiologyBot:
                 return
             
             user_query = input_data.get("query", "").strip()
+            # Fair queuing key: classroom if the client sends one, else student, else the headset's address
+            client_id = str(input_data.get("classroom_id") or input_data.get("student_id") or addr[0])
             
             if not user_query:
                 error_response = {
@@ -381,7 +554,7 @@ class MrRashidRAGBiologyBot:
                 self.send_json_bytes(conn, error_response)
                 return
             
-            bot_response = self.generate_response(user_query)
+            bot_response = self.generate_response(user_query, client_id)
             response_timestamp = datetime.now().isoformat()
             
             self.manage_conversation_history(user_query, bot_response, request_timestamp, response_timestamp)
@@ -391,6 +564,7 @@ class MrRashidRAGBiologyBot:
             
             if success:
                 self.save_conversation_history()
+                self.save_llm_stats()
                 print(f"Turn {self.turn_counter} completed for {addr}")
             else:
                 print(f"Failed to send response to {addr}")
@@ -415,10 +589,12 @@ class MrRashidRAGBiologyBot:
             print("Dr. Rashed RAG Biology Bot")
             print("=" * 60)
             print(f"Server listening on {self.host}:{self.port}")
-            print(f"Model: {self.model}")
+            print(f"Model: {self.model} (fallback: {self.fallback_model})")
+            print(f"LLM Scheduler: {self.scheduler_address[0]}:{self.scheduler_address[1]}")
             print(f"Current Turn: {self.turn_counter}")
             print(f"History Messages: {len(self.conversation_history)}")
             print(f"Curriculum Chunks: {len(self.df_chunks)}")
+            print(f"Cached Lessons: {len(self.lesson_cache)}")
             print("=" * 60)
             print("Waiting for VR client connections...")
             
@@ -449,6 +625,9 @@ class MrRashidRAGBiologyBot:
         self.running = False
         if self.server_socket:
             self.server_socket.close()
+        self.scheduler.stop()
+        self.save_llm_stats()
+        self.gateway.close()
         print("Server stopped!")
 
 
@@ -0,0 +1,30 @@
+"""
+offline job that pre-generates the static intent answers (summary, concept map,
+exam prep) for every chapter and lesson in the curriculum chunks
+- add your groq api key to use the llm
+- Update CHUNKS_PATH / INDEX_PATH to your local copies.
+- The server loads CACHE_PATH on startup and serves these answers instantly
+  whenever the top retrieved chunks all belong to the same lesson.
+- Each lesson is stored with a fingerprint of the model, prompts and its chunks;
+  the server ignores lessons whose fingerprint changed, and rerunning this job
+  regenerates only those (--overwrite regenerates everything).
+"""
+
+import sys
+from Rag_Model import MrRashidRAGBiologyBot
+
+API_KEY = ""
+CHUNKS_PATH = r"D:\Marwan\E-just\Semester 8\Graduation Project 2\Biology\Bio_curriculum_chunks1000_over20.csv"
+INDEX_PATH = r"D:\Marwan\E-just\Semester 8\Graduation Project 2\Biology\Bio_curriculum_faiss_index_1000_over20.bin"
+CACHE_PATH = "lesson_cache.json"
+
+
+def main():
+    overwrite = "--overwrite" in sys.argv
+    bot = MrRashidRAGBiologyBot(API_KEY, CHUNKS_PATH, INDEX_PATH, lesson_cache_path=CACHE_PATH)
+    bot.build_lesson_cache(overwrite=overwrite)
+    print(f"Lesson cache written to {CACHE_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""
+analytics over the quiz_attempts table for the teacher dashboard
+- attempts are loaded from the SQL dump (~/Database/vr_teacher_quiz_attempts.sql)
+  or from a local SQLite copy of the vr_teacher database into NumPy arrays.
+- per-question / per-student / per-quiz statistics are computed vectorized.
+- QuizAggregates keeps running totals that update in O(1) per new attempt; the quiz
+  server builds it once at startup and folds in every attempt submitted after that.
+- the difficulty spread of earlier attempts on the same quiz title is read from the
+  aggregates and turned into extra instructor notes for the next quiz generation
+  (see build_feedback_notes).
+"""
+
+import re
+import sqlite3
+import sys
+import numpy as np
+
+NUM_QUESTIONS = 10
+GRADE_COLUMNS = [f"q{i}_grade" for i in range(1, NUM_QUESTIONS + 1)]
+ATTEMPT_COLUMNS = ["attempt_id", "student_id", "quiz_id", "total_score", "taken_at"] + GRADE_COLUMNS
+MISS_RATE_THRESHOLD = 0.5
+EASY_RATE_THRESHOLD = 0.1
+MISSING_ID = -1
+
+INSERT_TEMPLATE = r"INSERT INTO `{table}` VALUES\s*(.+?);\s*$"
+VALUE_PATTERN = re.compile(r"'((?:[^'\\]|\\.)*)'|(NULL)|(-?\d+(?:\.\d+)?)")
+ESCAPE_PATTERN = re.compile(r"\\(.)", re.DOTALL)
+# mysqldump string escapes; \% and \_ keep their backslash, any other \x is just x
+MYSQL_ESCAPES = {"0": "\0", "b": "\b", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a", "%": "\\%", "_": "\\_"}
+
+
+def _unescape(text):
+    return ESCAPE_PATTERN.sub(lambda m: MYSQL_ESCAPES.get(m.group(1), m.group(1)), text)
+
+
+def _parse_row(row_text):
+    values = []
+    for quoted, null, number in VALUE_PATTERN.findall(row_text):
+        if null:
+            values.append(None)
+        elif number:
+            values.append(float(number) if "." in number else int(number))
+        else:
+            values.append(_unescape(quoted))
+    return values
+
+
+def _split_rows(values_text):
+    rows = []
+    depth = 0
+    in_string = False
+    start = 0
+    i = 0
+    while i < len(values_text):
+        ch = values_text[i]
+        if in_string:
+            if ch == "\\":
+                i += 1
+            elif ch == "'":
+                in_string = False
+        elif ch == "'":
+            in_string = True
+        elif ch == "(":
+            if depth == 0:
+                start = i + 1
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0:
+                rows.append(values_text[start:i])
+        i += 1
+    return rows
+
+
+def rows_to_arrays(rows):
+    """Convert quiz_attempts rows (ATTEMPT_COLUMNS order) into column arrays"""
+    n = len(rows)
+    attempts = {
+        "attempt_id": np.full(n, MISSING_ID, dtype=np.int64),
+        "student_id": np.full(n, MISSING_ID, dtype=np.int64),
+        "quiz_id": np.full(n, MISSING_ID, dtype=np.int64),
+        "total_score": np.full(n, np.nan, dtype=np.float64),
+        "taken_at": np.empty(n, dtype=object),
+        "grades": np.full((n, NUM_QUESTIONS), np.nan, dtype=np.float32),
+    }
+    for r, row in enumerate(rows):
+        for key, value in zip(("attempt_id", "student_id", "quiz_id", "total_score"), row[:4]):
+            if value is not None:
+                attempts[key][r] = value
+        attempts["taken_at"][r] = row[4]
+        for q, grade in enumerate(row[5:5 + NUM_QUESTIONS]):
+            if grade is not None:
+                attempts["grades"][r, q] = grade
+    return attempts
+
+
+def _load_dump_rows(sql_path, table):
+    with open(sql_path, "r", encoding="utf-8") as f:
+        dump = f.read()
+    pattern = re.compile(INSERT_TEMPLATE.format(table=table), re.MULTILINE | re.DOTALL)
+    rows = []
+    for match in pattern.finditer(dump):
+        for row_text in _split_rows(match.group(1)):
+            rows.append(_parse_row(row_text))
+    return rows
+
+
+def load_attempts_from_sql_dump(sql_path):
+    """Load quiz_attempts rows from a mysqldump file"""
+    return rows_to_arrays(_load_dump_rows(sql_path, "quiz_attempts"))
+
+
+def load_attempts_from_sqlite(db_path):
+    """Load quiz_attempts rows from a local SQLite stand-in of the vr_teacher database"""
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.execute(f"SELECT {', '.join(ATTEMPT_COLUMNS)} FROM quiz_attempts ORDER BY attempt_id")
+        rows = cursor.fetchall()
+    return rows_to_arrays(rows)
+
+
+def load_attempts(source):
+    """Load quiz_attempts from a .sql dump or a SQLite database file"""
+    if source.endswith(".sql"):
+        return load_attempts_from_sql_dump(source)
+    return load_attempts_from_sqlite(source)
+
+
+def load_quiz_titles(source):
+    """quiz_id -> title from quiz_definitions, read from a .sql dump or a SQLite database file"""
+    if source.endswith(".sql"):
+        rows = _load_dump_rows(source, "quiz_definitions")
+    else:
+        with sqlite3.connect(source) as conn:
+            rows = conn.execute("SELECT quiz_id, title FROM quiz_definitions").fetchall()
+    return {int(row[0]): row[1] for row in rows if row[0] is not None}
+
+
+def quiz_ids_for_title(quiz_titles, title):
+    """Ids of every quiz definition sharing a title (case and surrounding spaces ignored)"""
+    key = title.strip().lower()
+    return [quiz_id for quiz_id, quiz_title in quiz_titles.items() if (quiz_title or "").strip().lower() == key]
+
+
+def _group_sum(keys, values):
+    """Sum and count non-NaN values per unique key, returns (unique_keys, sums, counts)"""
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    valid = ~np.isnan(values)
+    sums = np.bincount(inverse, weights=np.where(valid, values, 0.0), minlength=len(unique_keys))
+    counts = np.bincount(inverse, weights=valid.astype(np.float64), minlength=len(unique_keys))
+    return unique_keys, sums, counts
+
+
+def _safe_divide(numerator, denominator):
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    out = np.full(np.broadcast(numerator, denominator).shape, np.nan)
+    return np.divide(numerator, denominator, out=out, where=denominator > 0)
+
+
+def per_question_stats(attempts, quiz_id):
+    """
+    Per-question answered count, mean grade and miss rate (share of answered questions graded 0)
+    for one quiz; question positions of different quizzes are unrelated, so they are never mixed.
+    """
+    grades = attempts["grades"][attempts["quiz_id"] == quiz_id]
+    answered = ~np.isnan(grades)
+    answered_count = answered.sum(axis=0)
+    grade_sum = np.where(answered, grades, 0.0).sum(axis=0)
+    missed_count = (answered & (grades <= 0)).sum(axis=0)
+    return {
+        "answered": answered_count,
+        "mean_grade": _safe_divide(grade_sum, answered_count),
+        "miss_rate": _safe_divide(missed_count, answered_count),
+    }
+
+
+def per_student_stats(attempts):
+    """Per-student attempt count, mean total score and score trend (slope per attempt)"""
+    order = np.argsort(attempts["attempt_id"], kind="stable")
+    student_ids = attempts["student_id"][order]
+    scores = attempts["total_score"][order]
+
+    unique_ids, inverse = np.unique(student_ids, return_inverse=True)
+    attempts_count = np.bincount(inverse, minlength=len(unique_ids))
+
+    # position of each attempt within its student's history, used as x for the trend
+    sorted_idx = np.argsort(inverse, kind="stable")
+    group_starts = np.cumsum(attempts_count) - attempts_count
+    position = np.empty(len(inverse), dtype=np.float64)
+    position[sorted_idx] = np.arange(len(inverse)) - np.repeat(group_starts, attempts_count)
+
+    valid = ~np.isnan(scores)
+    x = np.where(valid, position, 0.0)
+    y = np.where(valid, scores, 0.0)
+    n = np.bincount(inverse, weights=valid.astype(np.float64), minlength=len(unique_ids))
+    sx = np.bincount(inverse, weights=x, minlength=len(unique_ids))
+    sy = np.bincount(inverse, weights=y, minlength=len(unique_ids))
+    sxx = np.bincount(inverse, weights=x * x, minlength=len(unique_ids))
+    sxy = np.bincount(inverse, weights=x * y, minlength=len(unique_ids))
+
+    return {
+        "student_id": unique_ids,
+        "attempts": attempts_count,
+        "mean_score": _safe_divide(sy, n),
+        "trend": _safe_divide(n * sxy - sx * sy, n * sxx - sx * sx),
+    }
+
+
+def per_quiz_averages(attempts):
+    """Per-quiz attempt count and mean total score"""
+    quiz_ids, sums, counts = _group_sum(attempts["quiz_id"], attempts["total_score"])
+    _, inverse = np.unique(attempts["quiz_id"], return_inverse=True)
+    return {
+        "quiz_id": quiz_ids,
+        "attempts": np.bincount(inverse, minlength=len(quiz_ids)),
+        "mean_score": _safe_divide(sums, counts),
+    }
+
+
+class QuizAggregates:
+    """Running per-quiz and per-student totals, each add_attempt call is O(1)"""
+
+    def __init__(self, num_questions=NUM_QUESTIONS):
+        self.num_questions = num_questions
+        self.quizzes = {}
+        self.students = {}
+
+    def _quiz_entry(self, quiz_id):
+        entry = self.quizzes.get(quiz_id)
+        if entry is None:
+            entry = {
+                "attempts": 0,
+                "score_sum": 0.0,
+                "scored": 0,
+                "answered": np.zeros(self.num_questions, dtype=np.int64),
+                "grade_sum": np.zeros(self.num_questions, dtype=np.float64),
+                "missed": np.zeros(self.num_questions, dtype=np.int64),
+            }
+            self.quizzes[quiz_id] = entry
+        return entry
+
+    def _student_entry(self, student_id):
+        entry = self.students.get(student_id)
+        if entry is None:
+            entry = {"attempts": 0, "n": 0, "sx": 0.0, "sy": 0.0, "sxx": 0.0, "sxy": 0.0, "last_score": None}
+            self.students[student_id] = entry
+        return entry
+
+    def add_attempt(self, student_id, quiz_id, grades, total_score=None):
+        """Fold a single new attempt into the running totals"""
+        grades = np.asarray(
+            [np.nan if g is None else g for g in grades], dtype=np.float64
+        )[:self.num_questions]
+        answered = ~np.isnan(grades)
+
+        quiz = self._quiz_entry(quiz_id)
+        quiz["attempts"] += 1
+        quiz["answered"][:len(grades)] += answered
+        quiz["grade_sum"][:len(grades)] += np.where(answered, grades, 0.0)
+        quiz["missed"][:len(grades)] += answered & (grades <= 0)
+
+        student = self._student_entry(student_id)
+        x = float(student["attempts"])
+        student["attempts"] += 1
+        if total_score is not None:
+            y = float(total_score)
+            quiz["score_sum"] += y
+            quiz["scored"] += 1
+            student["n"] += 1
+            student["sx"] += x
+            student["sy"] += y
+            student["sxx"] += x * x
+            student["sxy"] += x * y
+            student["last_score"] = y
+
+    @classmethod
+    def from_attempts(cls, attempts):
+        """Seed the aggregates from loaded attempt arrays"""
+        aggregates = cls(attempts["grades"].shape[1])
+        order = np.argsort(attempts["attempt_id"], kind="stable")
+        for r in order:
+            score = attempts["total_score"][r]
+            aggregates.add_attempt(
+                int(attempts["student_id"][r]),
+                int(attempts["quiz_id"][r]),
+                attempts["grades"][r],
+                None if np.isnan(score) else float(score),
+            )
+        return aggregates
+
+    def quiz_stats(self, quiz_id):
+        quiz = self.quizzes.get(quiz_id)
+        if quiz is None:
+            return None
+        return {
+            "attempts": quiz["attempts"],
+            "answered": quiz["answered"].copy(),
+            "mean_score": quiz["score_sum"] / quiz["scored"] if quiz["scored"] else None,
+            "mean_grade": _safe_divide(quiz["grade_sum"], quiz["answered"]),
+            "miss_rate": _safe_divide(quiz["missed"], quiz["answered"]),
+        }
+
+    def student_stats(self, student_id):
+        student = self.students.get(student_id)
+        if student is None:
+            return None
+        n = student["n"]
+        denominator = n * student["sxx"] - student["sx"] ** 2
+        return {
+            "attempts": student["attempts"],
+            "mean_score": student["sy"] / n if n else None,
+            "last_score": student["last_score"],
+            "trend": (n * student["sxy"] - student["sx"] * student["sy"]) / denominator if denominator else None,
+        }
+
+
+def build_feedback_notes(quiz_notes, quiz_title, aggregates, quiz_ids):
+    """
+    Append the difficulty spread of earlier attempts on quiz_ids (from QuizAggregates) to the instructor notes.
+    The note talks about the topic and overall difficulty, not question positions, because
+    the next generation writes new questions and never sees the old ones.
+    """
+    if not quiz_ids:
+        raise ValueError("quiz_ids is required: feedback must come from attempts on the same quiz")
+
+    hard = easy = rated = 0
+    attempt_count = 0
+    answered_total = missed_total = 0.0
+    for quiz_id in quiz_ids:
+        stats = aggregates.quiz_stats(quiz_id)
+        if stats is None:
+            continue
+        rated_mask = stats["answered"] > 0
+        miss_rate = stats["miss_rate"][rated_mask]
+        answered = stats["answered"][rated_mask]
+        hard += int((miss_rate >= MISS_RATE_THRESHOLD).sum())
+        easy += int((miss_rate <= EASY_RATE_THRESHOLD).sum())
+        rated += len(miss_rate)
+        attempt_count += stats["attempts"]
+        answered_total += answered.sum()
+        missed_total += (miss_rate * answered).sum()
+    if not rated:
+        return quiz_notes
+
+    overall_miss = float(missed_total / answered_total)
+
+    if overall_miss >= MISS_RATE_THRESHOLD:
+        advice = "Make this quiz noticeably easier: more recall questions on the core ideas and fewer multi-step ones."
+    elif overall_miss <= EASY_RATE_THRESHOLD * 2:
+        advice = "Make this quiz harder: more application and multi-step questions that go beyond recall."
+    else:
+        advice = "Keep a similar overall difficulty with a smooth spread from easy to hard questions."
+    feedback = (
+        f"Feedback from {attempt_count} previous attempts on '{quiz_title}': students missed "
+        f"{overall_miss:.0%} of answers; {hard} of {rated} questions were missed by at least half "
+        f"of the students and {easy} were answered correctly by almost everyone. {advice}"
+    )
+    return f"{quiz_notes}\n{feedback}" if quiz_notes else feedback
+
+
+def _fmt(value, spec=".2f"):
+    """Format a statistic, printing n/a when it is NaN or missing"""
+    if value is None or np.isnan(value):
+        return "n/a"
+    return format(value, spec)
+
+
+def print_report(attempts):
+    print(f"Loaded {len(attempts['attempt_id'])} quiz attempts")
+
+    quizzes = per_quiz_averages(attempts)
+    print("\n=== QUIZZES ===")
+    for quiz_id, count, mean in zip(quizzes["quiz_id"], quizzes["attempts"], quizzes["mean_score"]):
+        question_stats = per_question_stats(attempts, quiz_id=quiz_id)
+        rates = " ".join(_fmt(r) for r in question_stats["miss_rate"])
+        print(f"Quiz {quiz_id}: {count} attempts, mean score {_fmt(mean)}")
+        print(f"   miss rate per question: {rates}")
+
+    students = per_student_stats(attempts)
+    print("\n=== STUDENTS ===")
+    for student_id, count, mean, trend in zip(
+        students["student_id"], students["attempts"], students["mean_score"], students["trend"]
+    ):
+        print(f"Student {student_id}: {count} attempts, mean score {_fmt(mean)}, trend {_fmt(trend, '+.2f')}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python quiz_analytics.py <vr_teacher_quiz_attempts.sql | vr_teacher.sqlite>")
+        exit(1)
+    print_report(load_attempts(sys.argv[1]))
@@ -3,26 +3,50 @@ code to generate Quizzes in the quiz classroom
 -add your grok api key to use the llm
 - Update HOST to the desired interface or IP.
 - Update PORT to the desired port number.
+- Update ATTEMPTS_SOURCE / DEFINITIONS_SOURCE to the .sql dumps or a SQLite copy of
+  the vr_teacher database; earlier attempts on the same quiz title tune the notes.
+  They are read once at startup, after that the VR client sends each submitted
+  attempt as {"attempt": {"quiz_id", "student_id", "grades", "total_score"}}.
 """
 
 import os
+import sys
 import json
 import socket
 import struct
-import requests
 from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from llm_gateway import LLMGateway
+from llm_scheduler import (RemoteLLMScheduler, RequestShedError, estimate_tokens, admission_hooks,
+                           PRIORITY_QUIZ, SCHEDULER_HOST, SCHEDULER_PORT)
+from quiz_analytics import (load_attempts, load_quiz_titles, quiz_ids_for_title, build_feedback_notes,
+                            QuizAggregates)
+
 HOST = "26.235.96.91"
 PORT = 8000
 DATASET_JSON = "bio_final_cleaned.json"
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 TOP_K = 1
 
+DATABASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Database")
+ATTEMPTS_SOURCE = os.path.join(DATABASE_DIR, "vr_teacher_quiz_attempts.sql")
+DEFINITIONS_SOURCE = os.path.join(DATABASE_DIR, "vr_teacher_quiz_definitions.sql")
+
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-GROQ_CHAT_ENDPOINT = "https://api.groq.com/openai/v1/chat/completions"
 GROQ_MODEL = "llama-3.1-8b-instant"
+LLM_TIMEOUT = 60
+LLM_STATS_PATH = "llm_latency_stats.json"
+MAX_TOKENS = 4000
+
+# Shared scheduler service (python llm_scheduler.py), also used by the QA server
+scheduler = RemoteLLMScheduler(SCHEDULER_HOST, SCHEDULER_PORT)
+# Quizzes take several seconds to generate, so only hedge once real latencies are known;
+# hedges only go out when the scheduler has spare capacity for them
+gateway = LLMGateway(GROQ_API_KEY, [GROQ_MODEL], default_timeout=LLM_TIMEOUT, initial_hedge_delay=LLM_TIMEOUT / 2,
+                     **admission_hooks(scheduler))
 
 def load_dataset(json_path):
     with open(json_path, "r", encoding="utf-8") as f:
@@ -59,7 +83,7 @@ def retrieve_top_k(query, model, index, texts, k=TOP_K):
             hits.append(text)
     return hits
 
-def call_groq_kimi_system(quiz_title, quiz_notes, retrieved_passages):
+def call_groq_kimi_system(quiz_title, quiz_notes, retrieved_passages, client_id="default"):
     system_message = {
         "role": "system",
         "content": (
@@ -98,28 +122,72 @@ def call_groq_kimi_system(quiz_title, quiz_notes, retrieved_passages):
         )
     }
 
-    payload = {
-        "model": GROQ_MODEL,
-        "messages": [system_message, user_message],
-        "temperature": 0.0,
-        "max_tokens": 4000
-    }
+    messages = [system_message, user_message]
+    return scheduler.run(
+        lambda remaining: gateway.chat(
+            messages,
+            model=GROQ_MODEL,
+            timeout=remaining,
+            temperature=0.0,
+            max_tokens=MAX_TOKENS
+        ),
+        model=GROQ_MODEL,
+        client_id=client_id,
+        priority=PRIORITY_QUIZ,
+        estimated_tokens=estimate_tokens(messages, MAX_TOKENS),
+        timeout=LLM_TIMEOUT,
+        # A full quiz needs most of the deadline to generate, don't admit it with seconds to spare
+        service_time=LLM_TIMEOUT / 2
+    )
 
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
+def load_quiz_history():
+    """Quiz titles and attempt aggregates, read once at startup"""
+    try:
+        quiz_titles = load_quiz_titles(DEFINITIONS_SOURCE)
+        aggregates = QuizAggregates.from_attempts(load_attempts(ATTEMPTS_SOURCE))
+        print(f"Loaded {len(quiz_titles)} quiz definitions and {len(aggregates.quizzes)} quizzes with attempts")
+        return quiz_titles, aggregates
+    except Exception as e:
+        print("Could not load previous attempts:", e)
+        return {}, QuizAggregates()
 
-    resp = requests.post(GROQ_CHAT_ENDPOINT, headers=headers, json=payload, timeout=60)
-    resp.raise_for_status()
-    return resp.json()["choices"][0]["message"]["content"]
+def record_attempt(attempt, aggregates):
+    """Fold an attempt the VR client just submitted into the aggregates"""
+    aggregates.add_attempt(
+        int(attempt["student_id"]),
+        int(attempt["quiz_id"]),
+        attempt.get("grades", []),
+        attempt.get("total_score")
+    )
+
+def add_attempt_feedback(quiz_title, quiz_notes, quiz_titles, aggregates, quiz_id=None):
+    """Extend the instructor notes with how students did on earlier quizzes with this title"""
+    try:
+        if quiz_id is not None:
+            # Quizzes defined after startup are only known from the request
+            quiz_titles.setdefault(int(quiz_id), quiz_title)
+        quiz_ids = quiz_ids_for_title(quiz_titles, quiz_title)
+        if quiz_id is not None and int(quiz_id) not in quiz_ids:
+            quiz_ids.append(int(quiz_id))
+        if not quiz_ids:
+            return quiz_notes
+        return build_feedback_notes(quiz_notes, quiz_title, aggregates, quiz_ids)
+    except Exception as e:
+        print("Could not add attempt feedback:", e)
+        return quiz_notes
 
-def generate_quiz(quiz_title, quiz_notes, model, index, texts):
+def generate_quiz(quiz_title, quiz_notes, model, index, texts, client_id="default", quiz_id=None,
+                  quiz_titles=None, aggregates=None):
+    if aggregates is not None:
+        quiz_notes = add_attempt_feedback(quiz_title, quiz_notes, quiz_titles, aggregates, quiz_id)
     retrieved = retrieve_top_k(quiz_title, model, index, texts, k=TOP_K)
     if not retrieved:
         return {"error": "No relevant passages found"}
 
-    raw_response = call_groq_kimi_system(quiz_title, quiz_notes, retrieved)
+    try:
+        raw_response = call_groq_kimi_system(quiz_title, quiz_notes, retrieved, client_id)
+    except RequestShedError as e:
+        return {"error": f"Quiz generator is busy, try again shortly: {e}"}
 
     try:
         json_text = raw_response.strip()
@@ -149,7 +217,7 @@ def generate_quiz(quiz_title, quiz_notes, model, index, texts):
 
     return parsed
 
-def handle_client(conn, addr, model, index, texts):
+def handle_client(conn, addr, model, index, texts, quiz_titles, aggregates):
     try:
         length_bytes = conn.recv(4)
         if not length_bytes:
@@ -164,14 +232,28 @@ def handle_client(conn, addr, model, index, texts):
             data += chunk
 
         request = json.loads(data.decode("utf-8"))
+        if "attempt" in request:
+            try:
+                record_attempt(request["attempt"], aggregates)
+                response = {"ok": True}
+            except (KeyError, TypeError, ValueError) as e:
+                response = {"error": f"Invalid attempt: {e}"}
+            response_bytes = json.dumps(response).encode("utf-8")
+            conn.sendall(struct.pack(">I", len(response_bytes)))
+            conn.sendall(response_bytes)
+            return
+
         quiz_title = request.get("title")
         quiz_notes = request.get("notes", "")
+        quiz_id = request.get("quiz_id")
+        client_id = str(request.get("classroom_id") or request.get("teacher_id") or addr[0])
 
         if not quiz_title:
             response = {"error": "Missing quiz title"}
         else:
             print(f"📝 Generating quiz for: {quiz_title}")
-            response = generate_quiz(quiz_title, quiz_notes, model, index, texts)
+            response = generate_quiz(quiz_title, quiz_notes, model, index, texts, client_id, quiz_id,
+                                     quiz_titles, aggregates)
 
             if "questions" in response and "answers" in response:
                 print("\n=== QUIZ ===")
@@ -187,6 +269,7 @@ def handle_client(conn, addr, model, index, texts):
         response_bytes = json.dumps(response, ensure_ascii=False).encode("utf-8")
         conn.sendall(struct.pack(">I", len(response_bytes)))
         conn.sendall(response_bytes)
+        gateway.save_stats(LLM_STATS_PATH)
 
     except Exception as e:
         print("Error handling client:", e)
@@ -196,6 +279,7 @@ def handle_client(conn, addr, model, index, texts):
 def start_server():
     texts = load_dataset(DATASET_JSON)
     model, index, _ = build_embeddings_index(texts)
+    quiz_titles, aggregates = load_quiz_history()
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_sock:
         server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -206,7 +290,7 @@ def start_server():
         while True:
             conn, addr = server_sock.accept()
             print("Connected by", addr)
-            handle_client(conn, addr, model, index, texts)
+            handle_client(conn, addr, model, index, texts, quiz_titles, aggregates)
 
 if __name__ == "__main__":
     if not GROQ_API_KEY:
@@ -0,0 +1,293 @@
+"""
+shared LLM gateway used by the QA and quiz servers
+- talks to any OpenAI-compatible chat completions endpoint (Groq by default),
+  set LLM_BASE_URL (or pass base_url) to point it at a local stub for testing,
+  see llm_stub_server.py.
+- keeps a pooled keep-alive HTTP session instead of opening a connection per call.
+- every call has a deadline; if the first request has not answered by the
+  model's recent p95 latency a hedged duplicate is sent, and the first reply wins.
+- when the primary model is slow (p95 above slow_threshold) or fails, the hedge /
+  retry goes to the next model in the list (e.g. kimi-k2 -> llama-3.1-8b-instant).
+- hedges and fail-overs are extra provider calls, so they only go out when the
+  admit hook (the rate-limit scheduler's try_acquire) grants capacity for them;
+  429 responses are reported per model through on_rate_limited.
+- per-model latency stats are available from stats() / save_stats().
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+
+GROQ_BASE_URL = "https://api.groq.com/openai/v1"
+
+DEFAULT_RETRY_AFTER = 10.0
+DEFAULT_TIMEOUT = 30.0
+CONNECT_TIMEOUT = 5.0
+INITIAL_HEDGE_DELAY = 3.0
+MIN_HEDGE_DELAY = 0.2
+MIN_SAMPLES_FOR_P95 = 20
+LATENCY_WINDOW = 200
+POOL_SIZE = 16
+
+
+class LLMGatewayError(Exception):
+    pass
+
+
+class LLMTimeoutError(LLMGatewayError):
+    pass
+
+
+class LatencyStats:
+    """Sliding window of successful call latencies plus counters for one model"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.successes = 0
+        self.errors = 0
+        self.hedges = 0
+        self.fallbacks = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def record_success(self, latency):
+        with self.lock:
+            self.requests += 1
+            self.successes += 1
+            self.latencies.append(latency)
+
+    def record_error(self):
+        with self.lock:
+            self.requests += 1
+            self.errors += 1
+
+    def record_hedge(self):
+        with self.lock:
+            self.hedges += 1
+
+    def record_fallback(self):
+        with self.lock:
+            self.fallbacks += 1
+
+    def record_throttled(self):
+        with self.lock:
+            self.throttled += 1
+
+    def percentile(self, q):
+        with self.lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(q * (len(samples) - 1))))
+        return samples[index]
+
+    def sample_count(self):
+        with self.lock:
+            return len(self.latencies)
+
+    def snapshot(self):
+        p50 = self.percentile(0.50)
+        p95 = self.percentile(0.95)
+        p99 = self.percentile(0.99)
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "successes": self.successes,
+                "errors": self.errors,
+                "hedges": self.hedges,
+                "fallbacks": self.fallbacks,
+                "throttled": self.throttled,
+                "samples": len(self.latencies),
+                "mean": sum(self.latencies) / len(self.latencies) if self.latencies else None,
+                "p50": p50,
+                "p95": p95,
+                "p99": p99
+            }
+
+
+class LLMGateway:
+    def __init__(self, api_key, models, base_url=None, pool_size=POOL_SIZE,
+                 default_timeout=DEFAULT_TIMEOUT, slow_threshold=None, hedge_quantile=0.95,
+                 initial_hedge_delay=INITIAL_HEDGE_DELAY, admit=None, on_rate_limited=None):
+        """
+        models: primary model first, then fallbacks in order of preference.
+        base_url: OpenAI-compatible API root; defaults to $LLM_BASE_URL, else Groq.
+        slow_threshold: seconds; once the primary's p95 exceeds it, hedges go to the fallback.
+        initial_hedge_delay: seconds to wait before hedging until enough latencies are recorded.
+        admit: admit(model, messages, params) -> bool, asked before every hedge or fail-over call;
+               without it extra calls are always sent.
+        on_rate_limited: on_rate_limited(model, retry_after) called on a 429 from the provider.
+        """
+        if not models:
+            raise ValueError("At least one model is required")
+        self.api_key = api_key
+        self.models = list(models)
+        base_url = base_url or os.environ.get("LLM_BASE_URL", GROQ_BASE_URL)
+        self.endpoint = base_url.rstrip("/") + "/chat/completions"
+        self.default_timeout = default_timeout
+        self.slow_threshold = slow_threshold
+        self.hedge_quantile = hedge_quantile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.admit = admit
+        self.on_rate_limited = on_rate_limited
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+        # Hedged and fallback requests run on this pool alongside the first one
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="llm-gateway")
+        self.model_stats = {model: LatencyStats() for model in self.models}
+        self.stats_lock = threading.Lock()
+
+    def _stats_for(self, model):
+        with self.stats_lock:
+            if model not in self.model_stats:
+                self.model_stats[model] = LatencyStats()
+            return self.model_stats[model]
+
+    def hedge_delay(self, model):
+        """Delay before sending a hedged duplicate: recent p95 latency of the model"""
+        stats = self._stats_for(model)
+        if stats.sample_count() < MIN_SAMPLES_FOR_P95:
+            return self.initial_hedge_delay
+        return max(MIN_HEDGE_DELAY, stats.percentile(self.hedge_quantile))
+
+    def is_slow(self, model):
+        if self.slow_threshold is None:
+            return False
+        stats = self._stats_for(model)
+        if stats.sample_count() < MIN_SAMPLES_FOR_P95:
+            return False
+        return stats.percentile(self.hedge_quantile) > self.slow_threshold
+
+    def _post(self, model, messages, deadline, params):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMTimeoutError(f"Deadline exceeded before calling {model}")
+
+        payload = dict(params)
+        payload["model"] = model
+        payload["messages"] = messages
+
+        stats = self._stats_for(model)
+        start = time.monotonic()
+        try:
+            resp = self.session.post(self.endpoint, json=payload,
+                                     timeout=(min(CONNECT_TIMEOUT, remaining), remaining))
+            resp.raise_for_status()
+            content = resp.json()["choices"][0]["message"]["content"]
+        except Exception as e:
+            stats.record_error()
+            self._report_rate_limited(model, e)
+            raise
+        stats.record_success(time.monotonic() - start)
+        return content
+
+    def _report_rate_limited(self, model, error):
+        response = getattr(error, "response", None)
+        if self.on_rate_limited is None or getattr(response, "status_code", None) != 429:
+            return
+        try:
+            retry_after = float(response.headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+        except (TypeError, ValueError):
+            retry_after = DEFAULT_RETRY_AFTER
+        self.on_rate_limited(model, retry_after)
+
+    def _admitted(self, model, messages, params):
+        """Ask the admit hook for capacity for an extra (hedge / fail-over) call"""
+        if self.admit is None or self.admit(model, messages, params):
+            return True
+        self._stats_for(model).record_throttled()
+        return False
+
+    def _next_model(self, models, index, messages, params):
+        """Next model in the list that the admit hook lets through"""
+        while index < len(models):
+            model = models[index]
+            index += 1
+            if self._admitted(model, messages, params):
+                return model, index
+        return None, index
+
+    def chat(self, messages, model=None, timeout=None, hedge=True, **params):
+        """
+        Return the reply text of the first successful completion.
+        Raises LLMTimeoutError once the deadline passes, LLMGatewayError if every model failed.
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        primary = model or self.models[0]
+        models = [primary] + [m for m in self.models if m != primary]
+        next_index = 1
+
+        pending = {self.executor.submit(self._post, primary, messages, deadline, params)}
+        hedge_at = time.monotonic() + self.hedge_delay(primary)
+        hedged = not hedge
+        last_error = None
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait_for = remaining if hedged else min(remaining, max(0.0, hedge_at - time.monotonic()))
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    return future.result().strip()
+                last_error = future.exception()
+                # Fail over to the next model straight away
+                fallback, next_index = self._next_model(models, next_index, messages, params)
+                if fallback is not None:
+                    self._stats_for(fallback).record_fallback()
+                    pending.add(self.executor.submit(self._post, fallback, messages, deadline, params))
+
+            if not hedged and time.monotonic() >= hedge_at:
+                hedged = True
+                target = None
+                if self.is_slow(primary):
+                    target, next_index = self._next_model(models, next_index, messages, params)
+                    if target is not None:
+                        self._stats_for(target).record_fallback()
+                if target is None and self._admitted(primary, messages, params):
+                    target = primary
+                # No capacity for a duplicate: keep waiting on the first request
+                if target is not None:
+                    self._stats_for(target).record_hedge()
+                    pending.add(self.executor.submit(self._post, target, messages, deadline, params))
+
+        if pending or isinstance(last_error, (LLMTimeoutError, requests.Timeout)):
+            raise LLMTimeoutError(f"No completion within {timeout:.1f}s") from last_error
+        raise LLMGatewayError(f"All models failed: {last_error}") from last_error
+
+    def stats(self):
+        with self.stats_lock:
+            items = list(self.model_stats.items())
+        return {model: stats.snapshot() for model, stats in items}
+
+    def save_stats(self, path):
+        """Export per-model latency stats to a JSON file"""
+        try:
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(self.stats(), file, indent=2)
+            return True
+        except Exception as e:
+            print(f"Error saving LLM stats: {e}")
+            return False
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
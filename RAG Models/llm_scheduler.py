@@ -0,0 +1,569 @@
+"""
+admission control in front of the LLM gateway
+- one request bucket and one token bucket per provider model (GROQ_MODEL_LIMITS) keep
+  traffic at the provider's per-model rate limits instead of bursting past them.
+- priority classes: quiz generation > live QA > background pre-generation.
+- within a priority class, classrooms / students are served round-robin so one
+  busy classroom cannot starve the others.
+- requests that can no longer finish before their deadline are shed early with
+  RequestShedError instead of being sent late.
+- a 429 from the provider pauses that model for Retry-After seconds; nothing is
+  retried automatically, so a rate limit never turns into a retry storm.
+- the gateway's hedges and fail-overs are extra calls; admission_hooks() makes them
+  take capacity through try_acquire, and they are skipped when none is free. Extra
+  calls never dig into a per-model reserve (EXTRA_CALL_RESERVE of each bucket, or the
+  largest recent quiz cost), so a burst of hedges cannot lock a teacher's quiz out.
+- the limits are per API key, so the QA and quiz servers share one scheduler:
+  run `python llm_scheduler.py` once and both servers connect to it through
+  RemoteLLMScheduler (same length-prefixed JSON over TCP as the VR clients use).
+  If the service is unreachable they fall back to a local scheduler per process,
+  each with 1 / FALLBACK_PROCESSES of the account limits, and only retry the
+  service every SERVICE_RETRY_INTERVAL seconds.
+"""
+
+import sys
+import json
+import time
+import socket
+import struct
+import threading
+from itertools import islice
+from collections import deque, OrderedDict
+
+PRIORITY_QUIZ = 0
+PRIORITY_LIVE_QA = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {
+    PRIORITY_QUIZ: "quiz",
+    PRIORITY_LIVE_QA: "live_qa",
+    PRIORITY_BACKGROUND: "background"
+}
+
+# model -> (requests per minute, tokens per minute) for the Groq account
+GROQ_MODEL_LIMITS = {
+    "moonshotai/kimi-k2-instruct": (60, 10000),
+    "llama-3.1-8b-instant": (30, 6000)
+}
+
+SCHEDULER_HOST = "26.68.227.247"
+SCHEDULER_PORT = 8100
+
+CHARS_PER_TOKEN = 4
+MIN_SERVICE_TIME = 1.0
+DEFAULT_RETRY_AFTER = 10.0
+CONNECT_TIMEOUT = 2.0
+SERVICE_RETRY_INTERVAL = 30.0
+FALLBACK_PROCESSES = 2
+EXTRA_CALL_RESERVE = 0.5
+QUIZ_COST_WINDOW = 20
+
+
+class RequestShedError(Exception):
+    pass
+
+
+def estimate_tokens(messages, max_tokens):
+    """Rough token cost of a chat call: prompt characters / 4 plus the completion budget"""
+    prompt_chars = sum(len(str(msg.get("content", ""))) for msg in messages)
+    return prompt_chars // CHARS_PER_TOKEN + max_tokens
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount, now):
+        """Seconds until amount can be taken (0 if available now)"""
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def backlog_time(self, amounts, now):
+        """Seconds until every amount in turn can be taken, each capped at capacity like take()"""
+        self.refill(now)
+        total = sum(min(amount, self.capacity) for amount in amounts)
+        return max(0.0, (total - self.level) / self.rate)
+
+    def take(self, amount, now):
+        self.refill(now)
+        self.level -= min(amount, self.capacity)
+
+    def drain(self, now):
+        self.refill(now)
+        self.level = 0.0
+
+
+class ModelLimiter:
+    """Request and token buckets of one provider model"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        # Recent quiz costs on this model; extra calls leave the largest of them in the bucket
+        self.quiz_costs = deque(maxlen=QUIZ_COST_WINDOW)
+
+    def wait_time(self, tokens, now):
+        return max(
+            self.paused_until - now,
+            self.request_bucket.time_until(1, now),
+            self.token_bucket.time_until(tokens, now)
+        )
+
+    def backlog_time(self, token_amounts, now):
+        wait_time = max(
+            self.request_bucket.backlog_time([1] * len(token_amounts), now),
+            self.token_bucket.backlog_time(token_amounts, now)
+        )
+        return max(wait_time, self.paused_until - now)
+
+    def has_spare(self, tokens, now):
+        """Whether an extra call fits now without taking the reserve kept for queued requests"""
+        if self.wait_time(tokens, now) > 0:
+            return False
+        token_reserve = max(self.token_bucket.capacity * EXTRA_CALL_RESERVE, max(self.quiz_costs, default=0))
+        request_reserve = self.request_bucket.capacity * EXTRA_CALL_RESERVE
+        return (self.token_bucket.level - tokens >= token_reserve
+                and self.request_bucket.level - 1 >= request_reserve)
+
+    def take(self, tokens, now):
+        self.request_bucket.take(1, now)
+        self.token_bucket.take(tokens, now)
+
+    def pause(self, seconds, now):
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.request_bucket.drain(now)
+        self.token_bucket.drain(now)
+
+
+class Ticket:
+    def __init__(self, client_id, priority, model, tokens, deadline, service_time):
+        self.client_id = client_id
+        self.priority = priority
+        self.model = model
+        self.tokens = tokens
+        self.deadline = deadline
+        self.service_time = service_time
+        self.granted = threading.Event()
+        self.shed_reason = None
+
+
+def admission_hooks(scheduler):
+    """LLMGateway keyword arguments that meter hedges / fail-overs and report 429s to the scheduler"""
+    return {
+        "admit": lambda model, messages, params: scheduler.try_acquire(
+            model, estimate_tokens(messages, params.get("max_tokens", 0))
+        ),
+        "on_rate_limited": scheduler.report_rate_limited
+    }
+
+
+class SchedulerClient:
+    """run() on top of acquire(); shared by the local and the remote scheduler"""
+
+    def run(self, fn, model, client_id="default", priority=PRIORITY_LIVE_QA, estimated_tokens=0,
+            timeout=30.0, service_time=None):
+        """
+        Wait for admission on model's buckets, then call fn(remaining_seconds) in the caller's thread.
+        service_time is how long the call itself needs once dispatched (defaults to MIN_SERVICE_TIME).
+        Raises RequestShedError if the request cannot be served before its deadline.
+        429s are reported by the gateway per model (see admission_hooks), not here.
+        """
+        deadline = time.monotonic() + timeout
+        self.acquire(model, client_id, priority, estimated_tokens, timeout, service_time)
+        return fn(deadline - time.monotonic())
+
+
+class LLMScheduler(SchedulerClient):
+    def __init__(self, model_limits=GROQ_MODEL_LIMITS, min_service_time=MIN_SERVICE_TIME):
+        self.limiters = {
+            model: ModelLimiter(requests_per_minute, tokens_per_minute)
+            for model, (requests_per_minute, tokens_per_minute) in model_limits.items()
+        }
+        self.min_service_time = min_service_time
+
+        # priority -> client_id -> deque of tickets; OrderedDict order is the round-robin order
+        self.queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self.queued_tokens = 0
+        self.queued_requests = 0
+        self.counters = {
+            "admitted": 0,
+            "dispatched": 0,
+            "opportunistic": 0,
+            "shed": 0,
+            "rejected": 0,
+            "rate_limited": 0
+        }
+
+        self.condition = threading.Condition()
+        self.running = True
+        self.dispatcher = threading.Thread(target=self._dispatch_loop, name="llm-scheduler", daemon=True)
+        self.dispatcher.start()
+
+    def _limiter(self, model):
+        limiter = self.limiters.get(model)
+        if limiter is None:
+            raise ValueError(f"No rate limits configured for model {model}")
+        return limiter
+
+    def _queued_tickets(self, model, max_priority=PRIORITY_BACKGROUND):
+        for priority in range(max_priority + 1):
+            for tickets in self.queues[priority].values():
+                for ticket in tickets:
+                    if ticket.model == model:
+                        yield ticket
+
+    def _tickets_ahead(self, model, priority, client_id):
+        """
+        Queued tickets on model that the dispatcher serves before a new ticket from client_id:
+        every higher-priority ticket and, within the same class, only as many of each client's
+        tickets as round-robin turns pass before the new ticket's own turn.
+        """
+        yield from self._queued_tickets(model, priority - 1)
+        clients = self.queues[priority]
+        turns = len(clients.get(client_id, ())) + 1
+        for tickets in clients.values():
+            for ticket in islice(tickets, turns):
+                if ticket.model == model:
+                    yield ticket
+
+    def _estimated_wait(self, model, priority, client_id, tokens, now):
+        """Time until a new request is dispatched: the tickets ahead of it on this model plus its own cost"""
+        token_amounts = [tokens] + [ticket.tokens for ticket in self._tickets_ahead(model, priority, client_id)]
+        return self._limiter(model).backlog_time(token_amounts, now)
+
+    def _enqueue(self, ticket):
+        tickets = self.queues[ticket.priority].setdefault(ticket.client_id, deque())
+        tickets.append(ticket)
+        self.queued_tokens += ticket.tokens
+        self.queued_requests += 1
+
+    def _shed(self, ticket, reason):
+        ticket.shed_reason = reason
+        self.counters["shed"] += 1
+        ticket.granted.set()
+
+    def _remove(self, ticket):
+        clients = self.queues[ticket.priority]
+        tickets = clients[ticket.client_id]
+        tickets.remove(ticket)
+        self.queued_tokens -= ticket.tokens
+        self.queued_requests -= 1
+        if not tickets:
+            del clients[ticket.client_id]
+
+    def _pop(self, ticket):
+        self._remove(ticket)
+        # Move the client to the back of the round-robin
+        clients = self.queues[ticket.priority]
+        if ticket.client_id in clients:
+            clients.move_to_end(ticket.client_id)
+
+    def _dispatch_once(self, now):
+        """
+        Grant at most one ticket. Returns 0 if one was granted, else how long to sleep (None = until notified).
+        Heads are visited by priority, then round-robin by client; once a model's head is blocked on its
+        buckets, lower-ranked tickets for that model wait too, but other models keep flowing.
+        """
+        blocked = set()
+        sleep_for = None
+        for priority in sorted(self.queues):
+            clients = self.queues[priority]
+            for client_id in list(clients):
+                ticket = clients[client_id][0]
+                if ticket.deadline - now < ticket.service_time:
+                    self._remove(ticket)
+                    self._shed(ticket, "deadline would pass before the request could complete")
+                    return 0
+                if ticket.model in blocked:
+                    continue
+                limiter = self.limiters[ticket.model]
+                wait_time = limiter.wait_time(ticket.tokens, now)
+                if wait_time <= 0:
+                    limiter.take(ticket.tokens, now)
+                    self._pop(ticket)
+                    self.counters["dispatched"] += 1
+                    ticket.granted.set()
+                    return 0
+                blocked.add(ticket.model)
+                # Wake up early if the head ticket would expire meanwhile
+                wake = min(wait_time, max(0.01, ticket.deadline - now - ticket.service_time))
+                sleep_for = wake if sleep_for is None else min(sleep_for, wake)
+        return sleep_for
+
+    def _dispatch_loop(self):
+        with self.condition:
+            while self.running:
+                sleep_for = self._dispatch_once(time.monotonic())
+                if sleep_for != 0:
+                    self.condition.wait(sleep_for)
+
+    def acquire(self, model, client_id="default", priority=PRIORITY_LIVE_QA, estimated_tokens=0,
+                timeout=30.0, service_time=None):
+        """Block until the request may be sent to model; raises RequestShedError instead if it would be late"""
+        service_time = self.min_service_time if service_time is None else service_time
+        now = time.monotonic()
+        ticket = Ticket(client_id, priority, model, estimated_tokens, now + timeout, service_time)
+
+        with self.condition:
+            if not self.running or not self.dispatcher.is_alive():
+                self.counters["rejected"] += 1
+                raise RequestShedError("scheduler is not running")
+            if priority == PRIORITY_QUIZ:
+                self._limiter(model).quiz_costs.append(estimated_tokens)
+            if self._estimated_wait(model, priority, client_id, estimated_tokens, now) + service_time > timeout:
+                self.counters["rejected"] += 1
+                raise RequestShedError(f"{PRIORITY_NAMES[priority]} request from {client_id} would miss its deadline")
+            self._enqueue(ticket)
+            self.counters["admitted"] += 1
+            self.condition.notify()
+
+        if not ticket.granted.wait(timeout=max(0.0, ticket.deadline - time.monotonic())):
+            with self.condition:
+                # The dispatcher may have granted it just as the wait timed out
+                if not ticket.granted.is_set():
+                    self._remove(ticket)
+                    self._shed(ticket, "deadline passed while queued")
+        if ticket.shed_reason:
+            raise RequestShedError(ticket.shed_reason)
+
+    def try_acquire(self, model, estimated_tokens=0):
+        """
+        Take capacity for an extra call (hedge / fail-over) only if nobody is queued for model and
+        the buckets keep their reserve afterwards (see ModelLimiter.has_spare).
+        """
+        with self.condition:
+            if not self.running or model not in self.limiters:
+                return False
+            if any(True for _ in self._queued_tickets(model)):
+                return False
+            now = time.monotonic()
+            limiter = self.limiters[model]
+            if not limiter.has_spare(estimated_tokens, now):
+                return False
+            limiter.take(estimated_tokens, now)
+            self.counters["opportunistic"] += 1
+            return True
+
+    def report_rate_limited(self, model, retry_after=DEFAULT_RETRY_AFTER):
+        """Stop dispatching to model for a while and empty its buckets, e.g. after a 429"""
+        with self.condition:
+            if model in self.limiters:
+                self.limiters[model].pause(retry_after, time.monotonic())
+            self.counters["rate_limited"] += 1
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            stats = dict(self.counters)
+            stats["queued_requests"] = self.queued_requests
+            stats["queued_tokens"] = self.queued_tokens
+            stats["queued_clients"] = {
+                PRIORITY_NAMES[p]: len(clients) for p, clients in self.queues.items()
+            }
+            return stats
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            for clients in self.queues.values():
+                for tickets in clients.values():
+                    for ticket in tickets:
+                        self._shed(ticket, "scheduler stopped")
+                clients.clear()
+            self.queued_tokens = 0
+            self.queued_requests = 0
+            self.condition.notify_all()
+
+
+def send_json(conn, data):
+    data_bytes = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    conn.sendall(struct.pack(">I", len(data_bytes)))
+    conn.sendall(data_bytes)
+
+
+def receive_json(conn):
+    def receive_exact(length):
+        data = b""
+        while len(data) < length:
+            chunk = conn.recv(length - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    length_bytes = receive_exact(4)
+    if length_bytes is None:
+        return None
+    data = receive_exact(struct.unpack(">I", length_bytes)[0])
+    return json.loads(data.decode("utf-8")) if data is not None else None
+
+
+def split_limits(model_limits, processes):
+    """Per-process share of the account limits, for schedulers that cannot coordinate"""
+    return {
+        model: (max(1, requests_per_minute // processes), max(1, tokens_per_minute // processes))
+        for model, (requests_per_minute, tokens_per_minute) in model_limits.items()
+    }
+
+
+class RemoteLLMScheduler(SchedulerClient):
+    """
+    Client of the shared scheduler service; falls back to a local LLMScheduler if it cannot connect.
+    After a failed connect the service is not tried again for SERVICE_RETRY_INTERVAL seconds, and
+    the local scheduler only gets 1 / fallback_processes of model_limits, since the other servers
+    fall back the same way and the provider limits are per API key.
+    """
+
+    def __init__(self, host=SCHEDULER_HOST, port=SCHEDULER_PORT, model_limits=GROQ_MODEL_LIMITS,
+                 fallback_processes=FALLBACK_PROCESSES):
+        self.host = host
+        self.port = port
+        self.model_limits = model_limits
+        self.fallback_processes = fallback_processes
+        self.local = None
+        self.local_lock = threading.Lock()
+        self.down_until = 0.0
+
+    def _local(self):
+        with self.local_lock:
+            if self.local is None:
+                self.local = LLMScheduler(split_limits(self.model_limits, self.fallback_processes))
+            return self.local
+
+    def _connect(self):
+        """Open a connection to the service, or None while it is known to be down"""
+        if time.monotonic() < self.down_until:
+            return None
+        try:
+            conn = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        except OSError:
+            with self.local_lock:
+                if time.monotonic() >= self.down_until:
+                    print(f"Scheduler service {self.host}:{self.port} unreachable, using a local scheduler "
+                          f"for {SERVICE_RETRY_INTERVAL:.0f}s")
+                self.down_until = time.monotonic() + SERVICE_RETRY_INTERVAL
+            return None
+        return conn
+
+    def _request(self, payload, timeout):
+        """Send one request; returns None if the service could not be reached"""
+        conn = self._connect()
+        if conn is None:
+            return None
+        try:
+            conn.settimeout(timeout + CONNECT_TIMEOUT)
+            send_json(conn, payload)
+            reply = receive_json(conn)
+        except OSError as e:
+            reply = {"ok": False, "error": f"scheduler service error: {e}"}
+        finally:
+            conn.close()
+        return reply if reply is not None else {"ok": False, "error": "scheduler service closed the connection"}
+
+    def acquire(self, model, client_id="default", priority=PRIORITY_LIVE_QA, estimated_tokens=0,
+                timeout=30.0, service_time=None):
+        reply = self._request({
+            "op": "acquire",
+            "model": model,
+            "client_id": client_id,
+            "priority": priority,
+            "tokens": estimated_tokens,
+            "timeout": timeout,
+            "service_time": service_time
+        }, timeout)
+        if reply is None:
+            return self._local().acquire(model, client_id, priority, estimated_tokens, timeout, service_time)
+        if not reply.get("ok"):
+            raise RequestShedError(reply.get("error", "rejected by scheduler service"))
+
+    def try_acquire(self, model, estimated_tokens=0):
+        reply = self._request({"op": "try_acquire", "model": model, "tokens": estimated_tokens}, CONNECT_TIMEOUT)
+        if reply is None:
+            return self._local().try_acquire(model, estimated_tokens)
+        return bool(reply.get("ok"))
+
+    def report_rate_limited(self, model, retry_after=DEFAULT_RETRY_AFTER):
+        reply = self._request({"op": "rate_limited", "model": model, "retry_after": retry_after}, CONNECT_TIMEOUT)
+        if reply is None:
+            self._local().report_rate_limited(model, retry_after)
+
+    def stats(self):
+        reply = self._request({"op": "stats"}, CONNECT_TIMEOUT)
+        if reply is None:
+            return self._local().stats()
+        return reply.get("stats", {})
+
+    def stop(self):
+        with self.local_lock:
+            if self.local is not None:
+                self.local.stop()
+
+
+def handle_scheduler_client(conn, addr, scheduler):
+    try:
+        request = receive_json(conn)
+        if not request:
+            return
+        op = request.get("op")
+        if op == "acquire":
+            try:
+                scheduler.acquire(
+                    request["model"],
+                    request.get("client_id", str(addr[0])),
+                    int(request.get("priority", PRIORITY_LIVE_QA)),
+                    int(request.get("tokens", 0)),
+                    float(request.get("timeout", 30.0)),
+                    request.get("service_time")
+                )
+                reply = {"ok": True}
+            except (RequestShedError, ValueError) as e:
+                reply = {"ok": False, "error": str(e)}
+        elif op == "try_acquire":
+            reply = {"ok": scheduler.try_acquire(request["model"], int(request.get("tokens", 0)))}
+        elif op == "rate_limited":
+            scheduler.report_rate_limited(request["model"], float(request.get("retry_after", DEFAULT_RETRY_AFTER)))
+            reply = {"ok": True}
+        elif op == "stats":
+            reply = {"ok": True, "stats": scheduler.stats()}
+        else:
+            reply = {"ok": False, "error": f"unknown op {op}"}
+        send_json(conn, reply)
+    except Exception as e:
+        print(f"Error handling scheduler client {addr}: {e}")
+    finally:
+        conn.close()
+
+
+def start_scheduler_server(host="0.0.0.0", port=SCHEDULER_PORT, model_limits=GROQ_MODEL_LIMITS):
+    scheduler = LLMScheduler(model_limits)
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_sock:
+        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_sock.bind((host, port))
+        server_sock.listen(50)
+        print(f"LLM scheduler listening on {host}:{port}")
+        for model, (requests_per_minute, tokens_per_minute) in model_limits.items():
+            print(f"   {model}: {requests_per_minute} req/min, {tokens_per_minute} tokens/min")
+
+        try:
+            while True:
+                conn, addr = server_sock.accept()
+                threading.Thread(target=handle_scheduler_client, args=(conn, addr, scheduler), daemon=True).start()
+        except KeyboardInterrupt:
+            scheduler.stop()
+            print("Scheduler stopped!")
+
+
+if __name__ == "__main__":
+    host = sys.argv[1] if len(sys.argv) > 1 else "0.0.0.0"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else SCHEDULER_PORT
+    start_scheduler_server(host, port)
@@ -0,0 +1,159 @@
+"""
+local OpenAI-compatible stub for testing the LLM gateway without an API key
+- python llm_stub_server.py          serves /v1/chat/completions on STUB_HOST:STUB_PORT;
+  start the QA / quiz servers with LLM_BASE_URL=http://127.0.0.1:8089/v1 to use it.
+- python llm_stub_server.py --demo   starts the stub in-process and exercises the
+  gateway's hedge, fallback and deadline paths, then prints per-model stats.
+Model names select the stub behaviour (see STUB_MODELS); any other model answers at once.
+"""
+
+import sys
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from llm_gateway import LLMGateway, LLMGatewayError, LLMTimeoutError, MIN_SAMPLES_FOR_P95
+
+STUB_HOST = "127.0.0.1"
+STUB_PORT = 8089
+
+# delay: seconds before answering, slow_every: only every n-th call is delayed,
+# degrade_after / degraded_delay: switch to a longer delay after that many calls,
+# status: HTTP error status to return instead of a completion
+STUB_MODELS = {
+    "stub-fast": {},
+    "stub-degrading": {"delay": 0.15, "degrade_after": 20, "degraded_delay": 3.0},
+    "stub-tail": {"delay": 2.0, "slow_every": 2},
+    "stub-hang": {"delay": 10.0},
+    "stub-broken": {"status": 500},
+    "stub-rate-limited": {"status": 429}
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    calls = {}
+    calls_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        model = request.get("model", "")
+        behaviour = STUB_MODELS.get(model, {})
+        with self.calls_lock:
+            self.calls[model] = self.calls.get(model, 0) + 1
+            call_number = self.calls[model]
+
+        if "status" in behaviour:
+            self._send_json(behaviour["status"], {"error": {"message": f"stub {model} error"}},
+                            headers={"Retry-After": "1"})
+            return
+        delay = behaviour.get("delay", 0.0)
+        if call_number > behaviour.get("degrade_after", call_number):
+            delay = behaviour["degraded_delay"]
+        slow_every = behaviour.get("slow_every", 1)
+        if call_number % slow_every == 1 % slow_every:
+            time.sleep(delay)
+
+        last_message = request.get("messages", [{}])[-1].get("content", "")
+        self._send_json(200, {
+            "id": f"stub-{model}-{call_number}",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": f"[{model}] {last_message[:80]}"},
+                "finish_reason": "stop"
+            }]
+        })
+
+
+def start_stub(host=STUB_HOST, port=0):
+    """Start the stub on a background thread, returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/v1"
+
+
+def run_demo():
+    server, base_url = start_stub()
+    messages = [{"role": "user", "content": "What is osmosis?"}]
+    ok = True
+
+    def check(name, passed, detail):
+        nonlocal ok
+        ok = ok and passed
+        print(f"{'PASS' if passed else 'FAIL'}  {name}: {detail}")
+
+    # Hedge: the first call stalls, the duplicate sent after the hedge delay answers first
+    gateway = LLMGateway("stub-key", ["stub-tail"], base_url=base_url, initial_hedge_delay=0.3)
+    start = time.monotonic()
+    reply = gateway.chat(messages, timeout=5.0)
+    elapsed = time.monotonic() - start
+    check("hedge", elapsed < 1.5 and gateway.stats()["stub-tail"]["hedges"] == 1,
+          f"{elapsed:.2f}s, reply {reply!r}")
+
+    # Fail-over: the primary returns 500, the fallback model answers
+    gateway = LLMGateway("stub-key", ["stub-broken", "stub-fast"], base_url=base_url)
+    reply = gateway.chat(messages, timeout=5.0)
+    check("fallback on error", reply.startswith("[stub-fast]"), repr(reply))
+
+    # Slow primary: once its p95 is above slow_threshold the hedge goes to the fallback model
+    gateway = LLMGateway("stub-key", ["stub-degrading", "stub-fast"], base_url=base_url,
+                         slow_threshold=0.1, initial_hedge_delay=0.3)
+    for _ in range(MIN_SAMPLES_FOR_P95):
+        gateway.chat(messages, timeout=5.0, hedge=False)
+    reply = gateway.chat(messages, timeout=5.0)
+    check("fallback when slow", reply.startswith("[stub-fast]"), repr(reply))
+
+    # Deadline: a hanging model raises LLMTimeoutError at the deadline
+    gateway = LLMGateway("stub-key", ["stub-hang"], base_url=base_url, initial_hedge_delay=0.2)
+    start = time.monotonic()
+    try:
+        gateway.chat(messages, timeout=1.0)
+        check("deadline", False, "no timeout raised")
+    except LLMTimeoutError as e:
+        elapsed = time.monotonic() - start
+        check("deadline", elapsed < 1.5, f"{elapsed:.2f}s, {e}")
+
+    # Every model failing surfaces as LLMGatewayError with the HTTP error chained
+    gateway = LLMGateway("stub-key", ["stub-rate-limited"], base_url=base_url)
+    try:
+        gateway.chat(messages, timeout=2.0)
+        check("all models failed", False, "no error raised")
+    except LLMGatewayError as e:
+        status = getattr(getattr(e.__cause__, "response", None), "status_code", None)
+        check("all models failed", status == 429, f"{e}")
+
+    print(json.dumps(gateway.stats(), indent=2))
+    server.shutdown()
+    return ok
+
+
+if __name__ == "__main__":
+    if "--demo" in sys.argv:
+        exit(0 if run_demo() else 1)
+    server = ThreadingHTTPServer((STUB_HOST, STUB_PORT), StubHandler)
+    print(f"LLM stub listening on http://{STUB_HOST}:{STUB_PORT}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()